@@ -0,0 +1,18 @@
+-- Migration to make waitlist emails unique regardless of case
+-- PostgREST on_conflict can only target columns (not index expressions), so the
+-- lower-cased email is stored in a generated column with a unique index on it.
+-- Imports use it for INSERT ... ON CONFLICT ("email_normalized") DO NOTHING.
+
+-- Existing rows are never deleted here: if emails that differ only by case exist,
+-- the migration fails. Review and run scripts/dedupe-waitlist-emails.sql first.
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM "waitlist" GROUP BY lower("email") HAVING count(*) > 1) THEN
+		RAISE EXCEPTION 'waitlist contains emails that differ only by case'
+			USING HINT = 'Review and run scripts/dedupe-waitlist-emails.sql, then rerun this migration';
+	END IF;
+END $$;
+--> statement-breakpoint
+ALTER TABLE "waitlist" ADD COLUMN IF NOT EXISTS "email_normalized" varchar(255) GENERATED ALWAYS AS (lower("email")) STORED;
+--> statement-breakpoint
+CREATE UNIQUE INDEX IF NOT EXISTS "waitlist_email_normalized_idx" ON "waitlist" ("email_normalized");
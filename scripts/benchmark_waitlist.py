@@ -0,0 +1,822 @@
+#!/usr/bin/env python3
+"""
+waitlist日志提取脚本的性能基准测试
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import resource
+import threading
+import contextlib
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from typing import Callable, Dict, List, Optional, Tuple
+
+from extract_waitlist_from_logs import WaitlistLogParser, WaitlistRecordScanner, WaitlistStats, DiskDeduplicator, iter_log_lines
+
+# 解析基准使用的样例记录，覆盖各种日志格式
+SAMPLE_RECORDS = [
+    '{"email":"alice@example.com","name":"Alice","source":"hero","company":"Acme",'
+    '"useCase":"writing","timestamp":"2025-07-21T10:00:00.000Z"}',
+    "{\n0|lovpen  |   email: 'bob@example.com',\n0|lovpen  |   name: 'Bob',\n"
+    "0|lovpen  |   source: 'pricing',\n0|lovpen  |   timestamp: '2025-07-21T11:00:00.000Z'\n0|lovpen  | }",
+    "{ email: 'carol@example.com', name: 'Carol', source: 'about', use_case: 'notes' }",
+    '{"email": "dave@example.com", "name": "Dave"}',
+]
+
+def legacy_parse_entry(match: str) -> Optional[Dict]:
+    """优化前的 _parse_entry 实现（逐个模式调用 re.search），作为对照"""
+    def extract_field(text, patterns):
+        for pattern in patterns:
+            found = re.search(pattern, text, re.IGNORECASE)
+            if found:
+                return found.group(1)
+        return None
+
+    cleaned = re.sub(r'^\d+\|\w+\s*\|\s*', '', match, flags=re.MULTILINE)
+    cleaned = re.sub(r'^\[\d{4}-\d{2}-\d{2}.*?\]\s*', '', cleaned, flags=re.MULTILINE)
+
+    email = extract_field(cleaned, [
+        r'"?email"?\s*[:\s]+\s*["\']([^"\']+)["\']',
+        r'email:\s*["\']([^"\']+)["\']',
+        r'"email":\s*"([^"]+)"'
+    ])
+    name = extract_field(cleaned, [
+        r'"?name"?\s*[:\s]+\s*["\']([^"\']+)["\']',
+        r'name:\s*["\']([^"\']+)["\']',
+        r'"name":\s*"([^"]+)"'
+    ])
+    source = extract_field(cleaned, [
+        r'"?source"?\s*[:\s]+\s*["\']([^"\']+)["\']',
+        r'source:\s*["\']([^"\']+)["\']',
+        r'"source":\s*"([^"]+)"'
+    ])
+    company = extract_field(cleaned, [
+        r'"?company"?\s*[:\s]+\s*["\']([^"\']*)["\']',
+        r'company:\s*["\']([^"\']*)["\']',
+        r'"company":\s*"([^"]*)"'
+    ]) or ''
+    usecase = extract_field(cleaned, [
+        r'"?useCase"?\s*[:\s]+\s*["\']([^"\']*)["\']',
+        r'useCase:\s*["\']([^"\']*)["\']',
+        r'"useCase":\s*"([^"]*)"',
+        r'"?use_case"?\s*[:\s]+\s*["\']([^"\']*)["\']'
+    ]) or ''
+    timestamp = extract_field(cleaned, [
+        r'"?timestamp"?\s*[:\s]+\s*["\']([^"\']+)["\']',
+        r'timestamp:\s*["\']([^"\']+)["\']',
+        r'"timestamp":\s*"([^"]+)"',
+        r'"?created_at"?\s*[:\s]+\s*["\']([^"\']+)["\']'
+    ])
+
+    if not (email and name and source):
+        return None
+
+    if timestamp:
+        try:
+            timestamp = timestamp.replace('Z', '+00:00')
+            datetime.fromisoformat(timestamp)
+        except ValueError:
+            timestamp = datetime.now().isoformat()
+    else:
+        timestamp = datetime.now().isoformat()
+
+    return {
+        'email': email.strip(),
+        'name': name.strip(),
+        'source': source.strip(),
+        'company': company.strip(),
+        'use_case': usecase.strip(),
+        'created_at': timestamp,
+        'status': 'pending',
+        'priority': 0
+    }
+
+# 优化前 extract_waitlist_entries 的三个正则（整个文件读入内存后分别 findall），作为吞吐量的对照
+LEGACY_PATTERNS = [
+    r'Saving waitlist entry:\s*(\{[^}]*(?:\n[^}]*)*\})',
+    r'waitlist submission:\s*(\{[^}]*(?:\n[^}]*)*\})',
+    r'waitlist.*?(\{[^}]*"email"[^}]*\})',
+]
+
+def make_extractor() -> WaitlistLogParser:
+    """创建只用于解析、不连接数据库的解析器"""
+    return WaitlistLogParser(quiet=True)
+
+def time_per_call(func: Callable[[str], Optional[Dict]], records: List[str], iterations: int, repeat: int) -> float:
+    """返回单条记录的平均耗时（微秒），取多轮中的最好成绩"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for record in records:
+                func(record)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+    return best / (iterations * len(records)) * 1e6
+
+def bench_parse(args):
+    """对比优化前后 _parse_entry 的单条耗时"""
+    extractor = make_extractor()
+
+    legacy = time_per_call(legacy_parse_entry, SAMPLE_RECORDS, args.iterations, args.repeat)
+    current = time_per_call(lambda record: extractor._parse_entry(record, 0), SAMPLE_RECORDS, args.iterations, args.repeat)
+
+    print("=== _parse_entry 单条耗时 ===")
+    print(f"优化前: {legacy:8.2f} µs/条")
+    print(f"优化后: {current:8.2f} µs/条")
+    print(f"加速比: {legacy / current:8.2f}x")
+
+# 回溯回归用例：每个函数生成约 `size` 个字符的异常日志
+PATHOLOGICAL_INPUTS = {
+    # 标记后一个很长的未闭合 `{`（旧的嵌套量词正则会在此处大量回溯）
+    'long_unterminated': lambda size: 'Saving waitlist entry: {' + 'a\n' * (size // 2),
+    # 大量标记后都没有 `}`
+    'many_unterminated': lambda size: "0|lovpen  | Saving waitlist entry: { email: 'a@b.c',\n" * (size // 50),
+    # 深度嵌套、迟迟不闭合的对象
+    'nested_braces': lambda size: 'waitlist submission: {{{{ "email": 1\n' * (size // 38) + '}\n',
+    # 大量不成对的引号
+    'unbalanced_quotes': lambda size: 'Saving waitlist entry: {' + '"\'' * (size // 2),
+    # 只有标记没有对象
+    'markers_only': lambda size: 'waitlist ' * (size // 9),
+}
+
+def time_scan(text: str, max_record_length: int) -> Tuple[float, float]:
+    """分别返回整段扫描和逐行流式扫描的耗时（秒）"""
+    start = time.perf_counter()
+    WaitlistRecordScanner(max_record_length).scan(text)
+    full = time.perf_counter() - start
+
+    scanner = WaitlistRecordScanner(max_record_length)
+    start = time.perf_counter()
+    for line in text.splitlines(keepends=True):
+        scanner.feed(line)
+    scanner.finish()
+    streaming = time.perf_counter() - start
+    return full, streaming
+
+def bench_pathological(args):
+    """异常输入下的扫描耗时，输入翻倍时耗时应大致翻倍（线性）"""
+    sizes = [args.size * (2 ** i) for i in range(args.steps)]
+    print(f"=== 异常输入扫描耗时（max_record_length={args.max_record_length:,}） ===")
+    print(f"{'用例':<20}{'大小':>12}{'整段扫描':>12}{'流式扫描':>12}")
+
+    slowest = 0.0
+    for name, generate in PATHOLOGICAL_INPUTS.items():
+        for size in sizes:
+            full, streaming = time_scan(generate(size), args.max_record_length)
+            slowest = max(slowest, full, streaming)
+            print(f"{name:<20}{size:>12,}{full:>11.3f}s{streaming:>11.3f}s")
+
+    if args.max_seconds and slowest > args.max_seconds:
+        print(f"✗ 最慢用例耗时 {slowest:.3f}s，超过上限 {args.max_seconds}s")
+        sys.exit(1)
+
+# === 合成日志 ===
+
+PM2_PREFIX = '0|lovpen  | '
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank', 'Grace', 'Heidi', '李雷', '韩梅梅', 'Ольга', 'José']
+DOMAINS = ['example.com', 'gmail.com', 'qq.com', 'outlook.com', 'company.io', '163.com']
+SOURCES = ['hero', 'pricing', 'about', 'footer', 'blog']
+COMPANIES = ['', '', 'Acme', 'Initech', 'Umbrella "Corp"', 'Foo {Bar}']
+USE_CASES = ['', 'writing', 'notes', 'team wiki', "it's for {docs}"]
+
+# 非waitlist的日志行：Next.js 请求日志、编译信息、错误堆栈、pm2 自身的输出
+NOISE_GENERATORS = [
+    lambda rng, ts: f"{PM2_PREFIX}GET /api/health 200 in {rng.randint(1, 40)}ms",
+    lambda rng, ts: f"{PM2_PREFIX}POST /api/waitlist 200 in {rng.randint(20, 400)}ms",
+    lambda rng, ts: f"{PM2_PREFIX}GET /_next/static/chunks/app/page-{rng.getrandbits(32):08x}.js 200 in {rng.randint(1, 9)}ms",
+    lambda rng, ts: f"{PM2_PREFIX} ✓ Compiled /api/waitlist in {rng.randint(100, 2000)}ms ({rng.randint(300, 1500)} modules)",
+    lambda rng, ts: f"{PM2_PREFIX}[{ts}] INFO: request completed {{ \"path\": \"/\", \"status\": 200 }}",
+    lambda rng, ts: (f"{PM2_PREFIX}Error: connect ETIMEDOUT 10.0.0.{rng.randint(1, 254)}:5432\n"
+                     f"{PM2_PREFIX}    at TCPConnectWrap.afterConnect [as oncomplete] (node:net:1555:16)\n"
+                     f"{PM2_PREFIX}    at async handler (/app/.next/server/app/api/waitlist/route.js:1:{rng.randint(100, 9999)})"),
+    lambda rng, ts: f"PM2        | {ts}: PM2 log: App [lovpen:0] online",
+    lambda rng, ts: f"{PM2_PREFIX}GET /waitlist?ref=twitter 200 in {rng.randint(5, 90)}ms",
+]
+
+def format_record(rng, entry: Dict[str, str], multiline: bool) -> str:
+    """按一种随机的日志格式输出waitlist条目"""
+    if multiline:
+        body = '\n'.join(
+            f"{PM2_PREFIX}  {key}: " + (f"'{value}'," if "'" not in value else f"{json.dumps(value, ensure_ascii=False)},")
+            for key, value in entry.items()
+        )
+        return f"{PM2_PREFIX}Saving waitlist entry: {{\n{body}\n{PM2_PREFIX}}}"
+
+    style = rng.randrange(3)
+    if style == 0:
+        return f"{PM2_PREFIX}Saving waitlist entry: {json.dumps(entry, ensure_ascii=False)}"
+    if style == 1:
+        fields = ', '.join(f"{key}: '{value}'" for key, value in entry.items() if "'" not in value)
+        return f"{PM2_PREFIX}waitlist submission: {{ {fields} }}"
+    return f"{PM2_PREFIX}[waitlist] payload {json.dumps(entry, ensure_ascii=False)}"
+
+def corrupt_record(rng, entry: Dict[str, str]) -> str:
+    """输出一条损坏的记录：未闭合、缺少必需字段、时间戳无效或包含无效字节"""
+    kind = rng.randrange(4)
+    if kind == 0:
+        text = json.dumps(entry, ensure_ascii=False)
+        return f"{PM2_PREFIX}Saving waitlist entry: {text[:rng.randrange(5, len(text) - 1)]}"
+    if kind == 1:
+        entry = {key: value for key, value in entry.items() if key != rng.choice(['name', 'source'])}
+    elif kind == 2:
+        entry = dict(entry, timestamp='not-a-date')
+    else:
+        entry = dict(entry, name=entry['name'] + '\udcff')
+    return f"{PM2_PREFIX}Saving waitlist entry: {json.dumps(entry, ensure_ascii=False)}"
+
+def generate_log(path: str, size: int, waitlist_ratio: float = 0.05, multiline_ratio: float = 0.3,
+                 duplicate_ratio: float = 0.1, corrupt_ratio: float = 0.02, seed: int = 0) -> Dict[str, int]:
+    """生成约 `size` 字节的 pm2/Next.js 日志，返回生成的行数和各类记录数"""
+    rng = random.Random(seed)
+    counts = {'bytes': 0, 'lines': 0, 'records': 0, 'multiline': 0, 'duplicates': 0, 'corrupt': 0}
+    emails: List[str] = []
+    clock = datetime(2024, 1, 1).timestamp()
+
+    with open(path, 'wb') as f:
+        while counts['bytes'] < size:
+            clock += rng.expovariate(1 / 3)
+            ts = datetime.fromtimestamp(clock, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+            if rng.random() >= waitlist_ratio:
+                text = rng.choice(NOISE_GENERATORS)(rng, ts)
+            else:
+                if emails and rng.random() < duplicate_ratio:
+                    email = rng.choice(emails)
+                    # 重复提交时大小写可能不同
+                    email = email.upper() if rng.random() < 0.2 else email
+                    counts['duplicates'] += 1
+                else:
+                    name = rng.choice(FIRST_NAMES)
+                    email = f"{name.lower()}.{len(emails)}@{rng.choice(DOMAINS)}"
+                    emails.append(email)
+                entry = {
+                    'email': email,
+                    'name': rng.choice(FIRST_NAMES),
+                    'source': rng.choice(SOURCES),
+                    'company': rng.choice(COMPANIES),
+                    'useCase': rng.choice(USE_CASES),
+                    'timestamp': ts,
+                }
+                if rng.random() < corrupt_ratio:
+                    text = corrupt_record(rng, entry)
+                    counts['corrupt'] += 1
+                else:
+                    multiline = rng.random() < multiline_ratio
+                    text = format_record(rng, entry, multiline)
+                    counts['multiline'] += multiline
+                counts['records'] += 1
+
+            data = (text + '\n').encode('utf-8', errors='surrogateescape')
+            f.write(data)
+            counts['bytes'] += len(data)
+            counts['lines'] += text.count('\n') + 1
+
+    return counts
+
+def bench_generate(args):
+    """生成合成日志文件"""
+    counts = generate_log(args.output, int(args.size * 1024 * 1024), args.waitlist_ratio, args.multiline_ratio,
+                          args.duplicate_ratio, args.corrupt_ratio, args.seed)
+    print(f"已生成 {args.output}: {counts['bytes']:,} 字节，{counts['lines']:,} 行")
+    print(f"waitlist记录 {counts['records']:,} 条（多行 {counts['multiline']:,}，重复邮箱 {counts['duplicates']:,}，"
+          f"损坏 {counts['corrupt']:,}）")
+
+# === 基准套件 ===
+
+class MockSupabaseQuery:
+    """模拟 supabase 查询构造器（只实现导入流程用到的部分）"""
+
+    def __init__(self, client: 'MockSupabaseClient'):
+        self.client = client
+        self.rows: List[Dict] = []
+        self.emails: Optional[List[str]] = None
+        self.upsert = False
+
+    def select(self, columns: str):
+        return self
+
+    def in_(self, column: str, values: List[str]):
+        self.emails = list(values)
+        return self
+
+    def insert(self, rows: List[Dict]):
+        self.rows = rows
+        return self
+
+    def upsert(self, rows: List[Dict], on_conflict: str = '', ignore_duplicates: bool = False):
+        self.rows = rows
+        self.upsert = True
+        return self
+
+    def execute(self):
+        if self.emails is not None:
+            data = [{'email': email} for email in self.emails if email in self.client.emails]
+        else:
+            data = []
+            for row in self.rows:
+                key = row['email'].lower()
+                if key in self.client.normalized:
+                    if self.upsert:
+                        continue
+                    raise RuntimeError(f"duplicate key value: {row['email']}")
+                self.client.emails.add(row['email'])
+                self.client.normalized.add(key)
+                data.append(row)
+        return type('Response', (), {'data': data})()
+
+class MockSupabaseClient:
+    """内存中的 waitlist 表，代替 Supabase 客户端"""
+
+    def __init__(self):
+        self.emails = set()
+        self.normalized = set()
+
+    def table(self, name: str) -> MockSupabaseQuery:
+        return MockSupabaseQuery(self)
+
+def read_log(log_file: str) -> str:
+    with open(log_file, 'rb') as f:
+        return f.read().decode('utf-8', errors='ignore')
+
+def stage_extract(log_file: str) -> Dict:
+    content = read_log(log_file)
+    extractor = make_extractor()
+    start = time.perf_counter()
+    entries = extractor.extract_waitlist_entries(content)
+    return {'seconds': time.perf_counter() - start, 'bytes': len(content.encode('utf-8')), 'entries': len(entries)}
+
+def stage_baseline(log_file: str) -> Dict:
+    """优化前的提取流程：整个文件读入内存，三个正则分别匹配后逐条用 legacy_parse_entry 解析"""
+    start = time.perf_counter()
+    with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read()
+    matches = [match for pattern in LEGACY_PATTERNS for match in re.findall(pattern, content, re.MULTILINE | re.DOTALL)]
+    count = sum(1 for match in matches if legacy_parse_entry(match))
+    return {'seconds': time.perf_counter() - start, 'bytes': os.path.getsize(log_file), 'entries': count}
+
+def stage_extract_default(log_file: str) -> Dict:
+    """命令行默认使用的提取流程（iter_files：按块读取、流式扫描和解析）"""
+    extractor = make_extractor()
+    start = time.perf_counter()
+    count = sum(1 for _ in extractor.iter_files([log_file]))
+    return {'seconds': time.perf_counter() - start, 'bytes': os.path.getsize(log_file), 'entries': count}
+
+def stage_extract_stream(log_file: str) -> Dict:
+    extractor = make_extractor()
+    start = time.perf_counter()
+    count = sum(1 for _ in extractor.iter_waitlist_entries(iter_log_lines(log_file)))
+    return {'seconds': time.perf_counter() - start, 'bytes': os.path.getsize(log_file), 'entries': count}
+
+def stage_extract_mmap(log_file: str) -> Dict:
+    extractor = make_extractor()
+    start = time.perf_counter()
+    count = sum(1 for _ in extractor.iter_mmap_entries(log_file))
+    return {'seconds': time.perf_counter() - start, 'bytes': os.path.getsize(log_file), 'entries': count}
+
+def stage_parse_entry(log_file: str) -> Dict:
+    records = WaitlistRecordScanner().scan(read_log(log_file))
+    extractor = make_extractor()
+    start = time.perf_counter()
+    count = sum(1 for index, (_, record) in enumerate(records) if extractor._parse_entry(record, index))
+    return {'seconds': time.perf_counter() - start, 'bytes': sum(len(record.encode('utf-8')) for _, record in records),
+            'entries': count}
+
+def stage_dedup(log_file: str) -> Dict:
+    extractor = make_extractor()
+    entries = extractor.extract_waitlist_entries(read_log(log_file))
+    start = time.perf_counter()
+    extractor.deduplicate_entries(entries)
+    return {'seconds': time.perf_counter() - start, 'bytes': None, 'entries': len(entries)}
+
+def stage_stats(log_file: str) -> Dict:
+    entries = make_extractor().extract_waitlist_entries(read_log(log_file))
+    start = time.perf_counter()
+    stats = WaitlistStats()
+    for entry in entries:
+        stats.add(entry)
+    stats.to_dict()
+    return {'seconds': time.perf_counter() - start, 'bytes': None, 'entries': len(entries)}
+
+def stage_dedup_disk(log_file: str) -> Dict:
+    entries = make_extractor().extract_waitlist_entries(read_log(log_file))
+    start = time.perf_counter()
+    with DiskDeduplicator() as dedup:
+        dedup.add(entries)
+        sum(1 for _ in dedup)
+    return {'seconds': time.perf_counter() - start, 'bytes': None, 'entries': len(entries)}
+
+def stage_main(log_file: str) -> Dict:
+    """完整的 main() 流程（提取、去重、检查已存在邮箱、导入），数据库使用内存模拟"""
+    import extract_waitlist_from_logs as module
+
+    client = MockSupabaseClient()
+    module.WaitlistExtractor.supabase = property(lambda self: client)
+    os.environ.update(NEXT_PUBLIC_SUPABASE_URL='http://127.0.0.1:54321', SUPABASE_SERVICE_ROLE_KEY='benchmark')
+    sys.argv = ['extract_waitlist_from_logs.py', log_file, '--quiet']
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            module.main()
+        except SystemExit:
+            pass
+    return {'seconds': time.perf_counter() - start, 'bytes': os.path.getsize(log_file), 'entries': len(client.emails)}
+
+SUITE_STAGES = {
+    'baseline': stage_baseline,
+    'extract_default': stage_extract_default,
+    'extract': stage_extract,
+    'extract_stream': stage_extract_stream,
+    'extract_mmap': stage_extract_mmap,
+    'parse_entry': stage_parse_entry,
+    'dedup': stage_dedup,
+    'stats': stage_stats,
+    'dedup_disk': stage_dedup_disk,
+    'main': stage_main,
+    'baseline_dense': stage_baseline,
+    'extract_default_dense': stage_extract_default,
+}
+
+# 在高密度合成日志（waitlist记录占比为 --dense-ratio）上运行的阶段，记录密集时扫描器的开销最明显
+DENSE_STAGES = ('baseline_dense', 'extract_default_dense')
+
+def _stage_process(name: str, log_file: str, conn):
+    result = SUITE_STAGES[name](log_file)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    result['peak_rss_mb'] = peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    conn.send(result)
+    conn.close()
+
+def run_stage(name: str, log_file: str) -> Dict:
+    """在新的子进程中运行一个阶段，峰值内存互不影响"""
+    context = multiprocessing.get_context('spawn')
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_stage_process, args=(name, log_file, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        raise RuntimeError(f"阶段 {name} 执行失败（退出码 {process.exitcode}）") from None
+    finally:
+        process.join()
+    return result
+
+def bench_suite(args):
+    """合成日志上的各阶段耗时、吞吐量和峰值内存，结果可保存为JSON并与之前的结果比较"""
+    stages = args.stages or list(SUITE_STAGES)
+    unknown = [name for name in stages if name not in SUITE_STAGES]
+    if unknown:
+        print(f"未知的阶段: {', '.join(unknown)}（可选: {', '.join(SUITE_STAGES)}）")
+        sys.exit(2)
+
+    if args.log:
+        # 已有的日志文件没有高密度版本
+        stages = [name for name in stages if name not in DENSE_STAGES]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = args.log
+        log_info = {'file': log_file, 'bytes': os.path.getsize(log_file)} if log_file else None
+        dense_file = dense_info = None
+        if not log_file:
+            log_file = os.path.join(tmp, 'synthetic.log')
+            log_info = generate_log(log_file, int(args.size * 1024 * 1024), args.waitlist_ratio, args.multiline_ratio,
+                                    args.duplicate_ratio, args.corrupt_ratio, args.seed)
+            log_info['size_mb'] = args.size
+            log_info['seed'] = args.seed
+            print(f"合成日志: {log_info['bytes']:,} 字节，waitlist记录 {log_info['records']:,} 条")
+        if any(name in DENSE_STAGES for name in stages):
+            dense_file = os.path.join(tmp, 'synthetic-dense.log')
+            dense_info = generate_log(dense_file, int(args.size * 1024 * 1024), args.dense_ratio, args.multiline_ratio,
+                                      args.duplicate_ratio, args.corrupt_ratio, args.seed)
+            dense_info['waitlist_ratio'] = args.dense_ratio
+            print(f"高密度合成日志: {dense_info['bytes']:,} 字节，waitlist记录 {dense_info['records']:,} 条")
+
+        results = {}
+        print(f"\n{'阶段':<24}{'耗时':>10}{'MB/s':>10}{'条目/s':>12}{'峰值内存':>12}")
+        for name in stages:
+            runs = [run_stage(name, dense_file if name in DENSE_STAGES else log_file) for _ in range(args.repeat)]
+            best = min(runs, key=lambda run: run['seconds'])
+            best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+            best['mb_per_s'] = best['bytes'] / best['seconds'] / 1e6 if best['bytes'] else None
+            best['entries_per_s'] = best['entries'] / best['seconds'] if best['seconds'] else None
+            results[name] = best
+            mb_per_s = f"{best['mb_per_s']:.1f}" if best['mb_per_s'] else '-'
+            print(f"{name:<24}{best['seconds']:>9.3f}s{mb_per_s:>10}{best['entries_per_s']:>12,.0f}"
+                  f"{best['peak_rss_mb']:>10.0f}MB")
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'log': log_info,
+        'dense_log': dense_info,
+        'stages': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到: {args.output}")
+
+    if args.compare:
+        compare_reports(args.compare, report, args.threshold)
+
+    check_baseline(results)
+
+def check_baseline(results: Dict[str, Dict]):
+    """默认提取流程比优化前的流程慢时以非零状态退出（普通日志和高密度日志分别检查，两个阶段都运行时才检查）"""
+    slower = False
+    for baseline_name, current_name, label in (('baseline', 'extract_default', ''),
+                                               ('baseline_dense', 'extract_default_dense', '（高密度）')):
+        if baseline_name not in results or current_name not in results:
+            continue
+        baseline = results[baseline_name]['seconds']
+        current = results[current_name]['seconds']
+        print(f"\n默认提取流程{label}: {current:.3f}s，优化前: {baseline:.3f}s（{baseline / current:.2f}x）")
+        if current > baseline:
+            print(f"✗ 默认提取流程{label}比优化前更慢")
+            slower = True
+    if slower:
+        sys.exit(1)
+
+def compare_reports(baseline_file: str, report: Dict, threshold: float):
+    """与之前保存的结果比较各阶段耗时，变慢超过 threshold 时以非零状态退出"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    print(f"\n=== 与 {baseline_file} 比较 ===")
+    if (baseline.get('log') or {}).get('bytes') != (report.get('log') or {}).get('bytes'):
+        print("注意: 两次运行的输入日志大小不同，耗时不能直接比较")
+    regressions = []
+    for name, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if not previous:
+            continue
+        change = current['seconds'] / previous['seconds'] - 1
+        rss_change = current['peak_rss_mb'] - previous['peak_rss_mb']
+        marker = '✗' if change > threshold else ' '
+        print(f"{marker} {name:<24}{previous['seconds']:>9.3f}s → {current['seconds']:>7.3f}s ({change:+.1%})"
+              f"  峰值内存 {rss_change:+.0f}MB")
+        if change > threshold:
+            regressions.append(name)
+
+    if regressions:
+        print(f"✗ {len(regressions)} 个阶段变慢超过 {threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXTRACT_SCRIPT = os.path.join(SCRIPT_DIR, 'extract_waitlist_from_logs.py')
+
+def import_times(module: str) -> Tuple[int, List[Tuple[int, str]]]:
+    """用 `python -X importtime` 导入模块，返回总耗时和直接依赖的耗时（微秒，按耗时降序）"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SCRIPT_DIR, capture_output=True, text=True, check=True
+    )
+    # 子模块的行先于父模块输出，缩进多一级
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return int(cumulative), sorted(children, reverse=True)
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative), name.strip()))
+    raise RuntimeError(f"没有找到 {module} 的导入耗时")
+
+def time_command(args: List[str], repeat: int) -> float:
+    """运行命令多次，返回最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, EXTRACT_SCRIPT] + args, capture_output=True, cwd=SCRIPT_DIR)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_startup(args):
+    """命令行启动耗时：模块导入明细和常用命令的总耗时"""
+    total, children = import_times('extract_waitlist_from_logs')
+    print("=== 模块导入耗时（-X importtime） ===")
+    print(f"{'extract_waitlist_from_logs':<32}{total / 1000:>10.1f} ms")
+    for cumulative, name in children[:args.top]:
+        print(f"  {name:<30}{cumulative / 1000:>10.1f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sample_log = os.path.join(tmp, 'sample.log')
+        with open(sample_log, 'w', encoding='utf-8') as f:
+            for record in SAMPLE_RECORDS:
+                f.write(f"0|lovpen  | Saving waitlist entry: {record}\n")
+
+        commands = {
+            '--help': ['--help'],
+            '--show-config': ['--show-config'],
+            '--dry-run': [sample_log, '--dry-run', '--quiet'],
+        }
+        print(f"\n=== 命令耗时（{args.repeat} 次取最短） ===")
+        slowest = 0.0
+        for label, command in commands.items():
+            elapsed = time_command(command, args.repeat)
+            slowest = max(slowest, elapsed)
+            print(f"{label:<32}{elapsed * 1000:>10.1f} ms")
+
+    if args.max_seconds and slowest > args.max_seconds:
+        print(f"✗ 最慢命令耗时 {slowest:.3f}s，超过上限 {args.max_seconds}s")
+        sys.exit(1)
+
+class MockPostgrestHandler(BaseHTTPRequestHandler):
+    """模拟 PostgREST 的 waitlist 表接口，用于在本地测试 --pipeline 导入
+    
+    支持 `GET ?email=in.(...)` 存在性查询和 `POST` 批量插入（含 on_conflict +
+    resolution=ignore-duplicates）。可按比例注入 429/503 响应和固定延迟。
+    """
+    
+    IN_VALUE = re.compile(r'"((?:[^"\\]|\\.)*)"|([^,]+)')
+    REQUIRED_FIELDS = ('email', 'name', 'source')
+    
+    # 由 serve_mock_postgrest 设置
+    emails: set = set()
+    normalized: set = set()
+    lock = threading.Lock()
+    error_rate = 0.0
+    latency = 0.0
+    counters: Dict[str, int] = {}
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def _send_json(self, status: int, body, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _inject_fault(self) -> bool:
+        """按配置的延迟和错误率处理请求，返回是否已经回复了错误响应"""
+        self._count('requests')
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            if random.random() < 0.5:
+                self._count('injected_429')
+                self._send_json(429, {'message': 'rate limited'}, {'Retry-After': '0'})
+            else:
+                self._count('injected_503')
+                self._send_json(503, {'message': 'service unavailable'})
+            return True
+        return False
+    
+    def do_GET(self):
+        if self._inject_fault():
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        condition = query.get('email', [''])[0]
+        if not (condition.startswith('in.(') and condition.endswith(')')):
+            self._send_json(400, {'message': f'unsupported filter: {condition}'})
+            return
+        values = [
+            re.sub(r'\\(.)', r'\1', match.group(1)) if match.group(1) is not None else match.group(2)
+            for match in self.IN_VALUE.finditer(condition[4:-1])
+        ]
+        with self.lock:
+            found = [{'email': email} for email in values if email in self.emails]
+        self._send_json(200, found)
+    
+    def do_POST(self):
+        if self._inject_fault():
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        ignore_duplicates = 'resolution=ignore-duplicates' in self.headers.get('Prefer', '')
+        upsert = query.get('on_conflict') == ['email_normalized'] and ignore_duplicates
+        rows = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        
+        for row in rows:
+            missing = [field for field in self.REQUIRED_FIELDS if not row.get(field)]
+            if missing:
+                self._send_json(400, {'code': '23502', 'message': f'null value in column "{missing[0]}"'})
+                return
+        
+        with self.lock:
+            inserted = []
+            batch = set()
+            for row in rows:
+                key = row['email'].lower()
+                if key in self.normalized or key in batch:
+                    if upsert:
+                        continue
+                    self._send_json(409, {'code': '23505', 'message': f'duplicate key value: {row["email"]}'})
+                    return
+                batch.add(key)
+                inserted.append(row)
+            for row in inserted:
+                self.emails.add(row['email'])
+                self.normalized.add(row['email'].lower())
+        self._count('inserted', len(inserted))
+        self._send_json(201, [{'email': row['email']} for row in inserted])
+
+def serve_mock_postgrest(args):
+    """启动模拟 PostgREST 服务，Ctrl+C 停止后输出请求统计"""
+    MockPostgrestHandler.error_rate = args.error_rate
+    MockPostgrestHandler.latency = args.latency
+    MockPostgrestHandler.counters = {}
+    server = ThreadingHTTPServer((args.host, args.port), MockPostgrestHandler)
+    print(f"模拟 PostgREST 服务: http://{args.host}:{args.port}/rest/v1/waitlist"
+          f"（错误率 {args.error_rate:.0%}，延迟 {args.latency * 1000:.0f}ms）")
+    print(f"导入时设置 NEXT_PUBLIC_SUPABASE_URL=http://{args.host}:{args.port} 并提供任意 SUPABASE_SERVICE_ROLE_KEY")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print(f"\n请求统计: {MockPostgrestHandler.counters}")
+    print(f"表中邮箱数: {len(MockPostgrestHandler.emails)}")
+
+def parse_arguments():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='waitlist日志提取脚本的性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help='_parse_entry 微基准（优化前后对比）')
+    parse_parser.add_argument('--iterations', type=int, default=2000, help='每轮解析样例记录的次数（默认: 2000）')
+    parse_parser.add_argument('--repeat', type=int, default=5, help='重复轮数，取最好成绩（默认: 5）')
+    parse_parser.set_defaults(func=bench_parse)
+
+    patho_parser = subparsers.add_parser('pathological', help='异常输入（未闭合对象、嵌套、引号）下的扫描耗时')
+    patho_parser.add_argument('--size', type=int, default=1_000_000, help='最小输入大小（字符，默认: 1000000）')
+    patho_parser.add_argument('--steps', type=int, default=3, help='输入大小翻倍的次数（默认: 3）')
+    patho_parser.add_argument('--max-record-length', type=int, default=WaitlistRecordScanner.DEFAULT_MAX_RECORD_LENGTH,
+                              help='扫描器的最大记录长度')
+    patho_parser.add_argument('--max-seconds', type=float, help='任一用例超过该耗时即以非零状态退出')
+    patho_parser.set_defaults(func=bench_pathological)
+
+    def add_generator_arguments(subparser, size: float):
+        subparser.add_argument('--size', type=float, default=size, help=f'合成日志的大小（MB，默认: {size:g}）')
+        subparser.add_argument('--waitlist-ratio', type=float, default=0.05, help='waitlist记录占日志条目的比例（默认: 0.05）')
+        subparser.add_argument('--multiline-ratio', type=float, default=0.3, help='多行对象占waitlist记录的比例（默认: 0.3）')
+        subparser.add_argument('--duplicate-ratio', type=float, default=0.1, help='重复邮箱占waitlist记录的比例（默认: 0.1）')
+        subparser.add_argument('--corrupt-ratio', type=float, default=0.02, help='损坏记录占waitlist记录的比例（默认: 0.02）')
+        subparser.add_argument('--seed', type=int, default=0, help='随机种子（默认: 0）')
+
+    generate_parser = subparsers.add_parser('generate', help='生成合成的 pm2/Next.js 日志')
+    generate_parser.add_argument('output', help='输出文件路径')
+    add_generator_arguments(generate_parser, 100)
+    generate_parser.set_defaults(func=bench_generate)
+
+    suite_parser = subparsers.add_parser('suite', help='各阶段耗时、吞吐量和峰值内存（结果可保存为JSON并比较）')
+    suite_parser.add_argument('--log', help='使用已有的日志文件，不生成合成日志（跳过高密度阶段）')
+    suite_parser.add_argument('--dense-ratio', type=float, default=0.5,
+                              help='高密度阶段的合成日志中waitlist记录的比例（默认: 0.5）')
+    add_generator_arguments(suite_parser, 20)
+    suite_parser.add_argument('--stages', nargs='+', metavar='STAGE',
+                              help=f'只运行指定的阶段（默认全部: {", ".join(SUITE_STAGES)}）')
+    suite_parser.add_argument('--repeat', type=int, default=1, help='每个阶段运行的次数，取最短耗时（默认: 1）')
+    suite_parser.add_argument('--output', '-o', metavar='FILE', help='把结果保存为JSON')
+    suite_parser.add_argument('--compare', metavar='FILE', help='与之前保存的JSON结果比较')
+    suite_parser.add_argument('--threshold', type=float, default=0.1,
+                              help='比较时耗时增加超过该比例视为性能回退，以非零状态退出（默认: 0.1）')
+    suite_parser.set_defaults(func=bench_suite)
+
+    startup_parser = subparsers.add_parser('startup', help='命令行启动耗时（模块导入明细、--help/--show-config/--dry-run）')
+    startup_parser.add_argument('--repeat', type=int, default=5, help='每个命令运行的次数，取最短耗时（默认: 5）')
+    startup_parser.add_argument('--top', type=int, default=10, help='显示耗时最多的前N个直接依赖（默认: 10）')
+    startup_parser.add_argument('--max-seconds', type=float, help='任一命令超过该耗时即以非零状态退出')
+    startup_parser.set_defaults(func=bench_startup)
+
+    mock_parser = subparsers.add_parser('mock-postgrest', help='启动模拟 PostgREST 服务，用于测试 --pipeline 导入')
+    mock_parser.add_argument('--host', default='127.0.0.1', help='监听地址（默认: 127.0.0.1）')
+    mock_parser.add_argument('--port', type=int, default=54329, help='监听端口（默认: 54329）')
+    mock_parser.add_argument('--error-rate', type=float, default=0.0, help='返回 429/503 的请求比例（默认: 0）')
+    mock_parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟（秒，默认: 0）')
+    mock_parser.set_defaults(func=serve_mock_postgrest)
+
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
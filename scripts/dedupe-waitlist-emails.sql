@@ -0,0 +1,40 @@
+-- Remove waitlist rows whose email differs from another row only by case.
+-- Run once, after review, before the email_normalized migration
+-- (migrations/0006_waitlist_email_unique.sql or
+-- supabase/migrations/20261018000000_waitlist_email_normalized.sql):
+--
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f scripts/dedupe-waitlist-emails.sql
+--
+-- For each lower(email), the row extract_waitlist_from_logs.py would keep is kept:
+-- the newest created_at, and the lowest id (first inserted) when created_at ties.
+-- Every deleted row is copied to waitlist_duplicates_archive first, with the id of
+-- the row that was kept, so it can be inspected or restored. To preview, replace
+-- the final COMMIT with ROLLBACK.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS waitlist_duplicates_archive (LIKE waitlist);
+ALTER TABLE waitlist_duplicates_archive ADD COLUMN IF NOT EXISTS kept_id bigint;
+ALTER TABLE waitlist_duplicates_archive ADD COLUMN IF NOT EXISTS archived_at timestamptz NOT NULL DEFAULT now();
+
+CREATE TEMP TABLE waitlist_duplicates ON COMMIT DROP AS
+SELECT id, first_value(id) OVER (
+        PARTITION BY lower(email)
+        ORDER BY created_at DESC, id ASC
+    ) AS kept_id
+FROM waitlist;
+
+DELETE FROM waitlist_duplicates WHERE id = kept_id;
+
+INSERT INTO waitlist_duplicates_archive
+SELECT waitlist.*, waitlist_duplicates.kept_id, now()
+FROM waitlist
+JOIN waitlist_duplicates USING (id);
+
+DELETE FROM waitlist
+USING waitlist_duplicates
+WHERE waitlist.id = waitlist_duplicates.id;
+
+SELECT count(*) AS archived_rows FROM waitlist_duplicates;
+
+COMMIT;
@@ -0,0 +1,785 @@
+"""
+extract_waitlist_from_logs.py 的回归测试：各种读取方式的结果一致、增量提取、继续导入和二分拆分重试
+
+运行: python -m pytest scripts（需要安装 requirements.txt 中的依赖和 pytest）
+"""
+import json
+import os
+import random
+import threading
+import time
+import _thread
+
+import pytest
+
+pytest.importorskip('dotenv')
+
+import extract_waitlist_from_logs as module
+from benchmark_waitlist import generate_log
+from extract_waitlist_from_logs import (
+    ExtractionState, ImportJournal, MarkerLineReader, WaitlistEntry, WaitlistExtractor, WaitlistLogParser,
+)
+
+# 记录最大长度较小，测试日志不大也能拆分为多个区间，损坏的记录很快被判断为超长
+MAX_RECORD_LENGTH = 400
+
+def make_parser(**kwargs) -> WaitlistLogParser:
+    parser = WaitlistLogParser(quiet=True, max_record_length=MAX_RECORD_LENGTH, **kwargs)
+    # 测试日志只有几百KB，允许按很小的区间拆分
+    parser.MIN_SHARD_BYTES = 0
+    return parser
+
+def snapshot(entries):
+    """条目的字段列表；时间戳无效时 created_at 是解析时的当前时间，各次运行不同，不参与比较"""
+    rows = []
+    for entry in entries:
+        row = entry.to_dict()
+        if not row['created_at'].endswith('+00:00'):
+            row['created_at'] = None
+        rows.append(row)
+    return rows
+
+@pytest.fixture(scope='module')
+def log_file(tmp_path_factory):
+    """约300KB的合成 pm2 日志：单行和多行记录、重复邮箱、未闭合和缺少字段等损坏的记录"""
+    path = str(tmp_path_factory.mktemp('logs') / 'app.log')
+    generate_log(path, 300 * 1024, waitlist_ratio=0.2, corrupt_ratio=0.05, seed=1)
+    return path
+
+@pytest.fixture(scope='module')
+def expected(log_file):
+    """逐行读取、整体扫描的结果，作为其他读取方式的对照"""
+    parser = make_parser()
+    entries = list(parser.iter_waitlist_entries(module.iter_log_lines(log_file)))
+    assert len(entries) > 100
+    return snapshot(entries)
+
+@pytest.mark.parametrize('block_bytes', [module.READ_BATCH_BYTES, 4096, 100])
+def test_serial_blocks_match_line_scan(log_file, expected, monkeypatch, block_bytes):
+    # 块越小，记录越常跨越块的边界
+    monkeypatch.setattr(module, 'READ_BATCH_BYTES', block_bytes)
+    assert snapshot(make_parser().extract_files([log_file])) == expected
+
+@pytest.mark.parametrize('block_bytes', [MarkerLineReader.BLOCK_BYTES, 256])
+def test_mmap_matches_serial(log_file, expected, monkeypatch, block_bytes):
+    monkeypatch.setattr(MarkerLineReader, 'BLOCK_BYTES', block_bytes)
+    monkeypatch.setattr(module, 'READ_BATCH_BYTES', 4 * block_bytes)
+    assert snapshot(make_parser(use_mmap=True).extract_files([log_file])) == expected
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_jobs_match_serial(log_file, expected, use_mmap):
+    parser = make_parser(use_mmap=use_mmap)
+    assert len(parser._plan_shards(log_file, 'utf-8', 4)) == 4
+    assert snapshot(parser.extract_files([log_file], jobs=4)) == expected
+
+@pytest.mark.parametrize('jobs,use_mmap', [(1, False), (1, True), (3, False)])
+def test_incremental_runs_match_full_run(log_file, expected, tmp_path, jobs, use_mmap):
+    """日志分几次追加写入（切分点可能在记录和行的中间），每次运行后保存状态，各次的结果拼接后与完整运行相同"""
+    with open(log_file, 'rb') as f:
+        content = f.read()
+    cuts = sorted(random.Random(2).sample(range(1, len(content)), 5)) + [len(content)]
+    growing = str(tmp_path / 'app.log')
+    state_file = str(tmp_path / 'state.json')
+    open(growing, 'wb').close()
+
+    entries = []
+    written = 0
+    for cut in cuts:
+        with open(growing, 'ab') as f:
+            f.write(content[written:cut])
+        written = cut
+        state = ExtractionState(state_file)
+        parser = make_parser(use_mmap=use_mmap)
+        entries.extend(parser.extract_files([growing], jobs=jobs, state=state))
+        state.save(state.to_dict(parser.stats))
+
+    # 最后一次运行时文件以换行结尾，末尾的记录都已输出
+    assert content.endswith(b'\n')
+    assert snapshot(entries) == expected
+    # 文件没有新内容时不再输出任何条目
+    assert make_parser().extract_files([growing], state=ExtractionState(state_file)) == []
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_incremental_skips_records_already_output(tmp_path, use_mmap):
+    """一行中的记录已输出、同一行开始的下一条记录还未闭合时，续读位置在这一行的行首，下次运行跳过已输出的记录"""
+    first = ('0|lovpen  | Saving waitlist entry: {"email": "a@example.com", "name": "A", "source": "hero"} '
+             'waitlist submission: {\n')
+    rest = "0|lovpen  |   email: 'b@example.com', name: 'B', source: 'pricing'\n0|lovpen  | }\n"
+    path = str(tmp_path / 'app.log')
+    state_file = str(tmp_path / 'state.json')
+
+    emails = []
+    for chunk in (first, rest):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(chunk)
+        state = ExtractionState(state_file)
+        emails.extend(entry.email for entry in make_parser(use_mmap=use_mmap).extract_files([path], state=state))
+        state.save()
+        if chunk is first:
+            saved = state.files[os.path.abspath(path)]
+            assert (saved['offset'], saved['skip_records']) == (0, 1)
+
+    assert emails == ['a@example.com', 'b@example.com']
+
+def saving_line(email: str) -> str:
+    return (f'0|lovpen  | Saving waitlist entry: {{"email": "{email}", "name": "X", "source": "hero", '
+            f'"timestamp": "2025-07-21T10:00:00.000Z"}}\n')
+
+@pytest.mark.parametrize('rotate', [False, True])
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_incremental_does_not_hold_back_entries_after_truncated_record(tmp_path, rotate, use_mmap):
+    """默认的最大记录长度下，被截断的记录不会挡住其后的条目；文件不再增长或被轮转后，末尾的截断记录之后的条目也会输出"""
+    broken = '0|lovpen  | Saving waitlist entry: {"email": "broken@example.com", "name": "X"\n'
+    path = str(tmp_path / 'app.log')
+    state_file = str(tmp_path / 'state.json')
+
+    def run(files):
+        state = ExtractionState(state_file)
+        parser = WaitlistLogParser(quiet=True, use_mmap=use_mmap)
+        emails = [entry.email for entry in parser.extract_files(files, state=state)]
+        state.save(state.to_dict(parser.stats))
+        return emails
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(saving_line('a@example.com') + broken + saving_line('b@example.com') + saving_line('c@example.com'))
+    assert run([path]) == ['a@example.com', 'b@example.com', 'c@example.com']
+
+    # 末尾是截断的记录，之后的记录的 `{` 在标记的下一行：只有确定文件不会再写入后才能判断前一条记录被截断
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(saving_line('d@example.com') + broken)
+        f.write('0|lovpen  | Saving waitlist entry:\n0|lovpen  | {"email": "e@example.com", "name": "E", "source": "hero"}\n')
+    assert run([path]) == ['d@example.com']
+
+    files = [path]
+    if rotate:
+        os.rename(path, path + '.1')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(saving_line('f@example.com'))
+        files = [path + '.1', path]
+    assert run(files) == ['e@example.com'] + (['f@example.com'] if rotate else [])
+    assert run(files) == []
+
+def test_json_inputs_are_detected_by_content(tmp_path, monkeypatch):
+    """扩展名为 .json/.jsonl 的输入只有内容是提取结果时才直接导入，其他内容按日志解析"""
+    extracted = tmp_path / 'extracted.json'
+    extracted.write_text(json.dumps([WaitlistEntry('a@example.com', 'A', 'hero').to_dict()]), encoding='utf-8')
+    log_json = tmp_path / 'app.json'
+    log_json.write_text(saving_line('b@example.com'), encoding='utf-8')
+    log_jsonl = tmp_path / 'app.jsonl'
+    log_jsonl.write_text('{"level": "info", "message": "server started"}\n' + saving_line('c@example.com'), encoding='utf-8')
+    output = str(tmp_path / 'entries.jsonl')
+    monkeypatch.setattr('sys.argv', ['extract_waitlist_from_logs.py', str(extracted), str(log_json), str(log_jsonl),
+                                     '--dry-run', '--quiet', '--output', output])
+    module.main()
+
+    with open(output, encoding='utf-8') as f:
+        assert sorted(json.loads(line)['email'] for line in f) == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert module.detect_extracted_format(str(extracted)) == 'json'
+    assert module.detect_extracted_format(str(log_json)) is None
+
+@pytest.mark.parametrize('record', [
+    '{"email": "a@example.com", "name": "{x}"}',
+    '{"email": "a@example.com", "name": "it\'s \\"{"}',
+    "{'email': 'a@example.com', 'name': \"}{\"}",
+    '{"email": "a@example.com", "meta": {"tags": ["{", "}"]}}',
+])
+def test_scanner_pairs_braces_in_strings_and_nested_objects(record):
+    """字符串中的括号、转义和混用的引号不参与配对，嵌套对象整体作为一条记录"""
+    scanner = module.WaitlistRecordScanner(max_record_length=MAX_RECORD_LENGTH)
+    text = f'Saving waitlist entry: {record}\nwaitlist {{"email": "b@example.com"}}\n'
+    assert [body for _, body in scanner.scan(text)] == [record, '{"email": "b@example.com"}']
+    assert scanner.skipped == {'oversized': 0, 'unterminated': 0}
+
+@pytest.mark.parametrize('record,path', [
+    ('{"Email": "a@example.com", "NAME": "A", "Source": "hero", "useCase": "notes", "Timestamp": "2025-07-21T10:00:00Z"}',
+     'json'),
+    ('{"event": "signup", "data": {"email": "a@example.com", "name": "A", "source": "hero", "use_case": "notes", '
+     '"timestamp": "2025-07-21T10:00:00Z"}}', 'regex'),
+    ('{"email": "a@example.com", "use_case": "notes", "meta": {"name": "A", "source": "hero"}, '
+     '"created_at": "2025-07-21T10:00:00Z"}', 'regex'),
+])
+def test_json_records_match_keys_case_insensitively_and_fall_back_to_regex(record, path):
+    """JSON记录的字段名不区分大小写；顶层缺少必需字段时使用正则提取（顶层已有的字段优先）"""
+    parser = make_parser()
+    entry = parser._parse_entry(record, 1)
+    assert entry is not None
+    assert (entry.email, entry.name, entry.source, entry.use_case, entry.created_at) == (
+        'a@example.com', 'A', 'hero', 'notes', '2025-07-21T10:00:00+00:00')
+    assert parser.stats.parse_paths[path] == 1
+
+def test_scanner_skips_truncated_record_before_next_record():
+    scanner = module.WaitlistRecordScanner(max_record_length=MAX_RECORD_LENGTH)
+    text = 'Saving waitlist entry: {"email": "x@example.com", "meta": {"a": "}"\nwaitlist {"email": "b@example.com"}\n'
+    assert [body for _, body in scanner.scan(text)] == ['{"email": "b@example.com"}']
+    assert scanner.skipped == {'oversized': 0, 'unterminated': 1}
+
+class StopFollowing(Exception):
+    pass
+
+def test_follow_emits_entries_after_truncated_record_promptly(tmp_path):
+    """跟踪模式下截断的记录之后的条目在下一次轮询或流空闲后就输出，不需要等到超过最大记录长度"""
+    broken = '0|lovpen  | Saving waitlist entry: {"email": "broken@example.com", "name": "X"\n'
+    path = str(tmp_path / 'app.log')
+    open(path, 'w').close()
+    state = ExtractionState(str(tmp_path / 'state.json'))
+    # 空文件处理过之后从头跟踪
+    state.update(path)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(saving_line('a@example.com') + broken + saving_line('b@example.com') + broken)
+        f.write('0|lovpen  | Saving waitlist entry:\n0|lovpen  | {"email": "c@example.com", "name": "C", "source": "hero"}\n')
+
+    emails = []
+
+    def on_batch(entries):
+        emails.extend(entry.email for entry in entries)
+        if 'c@example.com' in emails:
+            raise StopFollowing
+        return True
+
+    # 失败时不会一直跟踪下去
+    timer = threading.Timer(10, _thread.interrupt_main)
+    timer.start()
+    started = time.monotonic()
+    try:
+        with pytest.raises(StopFollowing):
+            make_parser().follow([path], on_batch, flush_size=1, flush_interval=0.05, poll_interval=0.05, state=state)
+    finally:
+        timer.cancel()
+    assert emails == ['a@example.com', 'b@example.com', 'c@example.com']
+    assert time.monotonic() - started < 5
+
+def test_log_follower_reads_in_bounded_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(module, 'READ_BATCH_BYTES', 1000)
+    path = str(tmp_path / 'app.log')
+    lines = [f'line {i:05d} ' + 'x' * 80 + '\n' for i in range(200)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    follower = module.LogFollower(path, offset=0)
+    # 读到一半时轮转：旧文件的剩余内容仍然分块读完，再切换到新文件
+    os.rename(path, path + '.1')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('new\n')
+
+    read = []
+    while True:
+        polled, switched = follower.poll()
+        assert sum(len(line) for _, line in polled) < 1000 + 100
+        read.extend(line for _, line in polled)
+        if switched:
+            break
+    assert read == lines
+    assert follower.poll() == ([(4, 'new\n')], False)
+    follower.close()
+
+def to_docker(lines, piece_chars):
+    """把应用输出的行按 Docker json-file 日志驱动的格式封装，长行拆分为多段，段之间夹着 stderr 的行"""
+    for i, line in enumerate(lines):
+        pieces = [line[start:start + piece_chars] for start in range(0, len(line), piece_chars)] or ['']
+        for j, piece in enumerate(pieces):
+            yield json.dumps({'log': piece, 'stream': 'stdout', 'time': '2025-07-21T10:00:00.000000000Z'}) + '\n'
+            if j == 0 and i % 7 == 0:
+                yield json.dumps({'log': f'stderr {i}\n', 'stream': 'stderr', 'time': '2025-07-21T10:00:00.000000000Z'}) + '\n'
+
+def to_cri(lines, piece_chars):
+    """把应用输出的行按 containerd/CRI-O 的格式封装，P 表示这一行还没有结束"""
+    for i, line in enumerate(lines):
+        text = line[:-1] if line.endswith('\n') else line
+        pieces = [text[start:start + piece_chars] for start in range(0, len(text), piece_chars)] or ['']
+        for j, piece in enumerate(pieces):
+            tag = 'F' if j == len(pieces) - 1 else 'P'
+            yield f'2025-07-21T10:00:00.000000000Z stdout {tag} {piece}\n'
+            if j == 0 and i % 7 == 0:
+                yield f'2025-07-21T10:00:00.000000000Z stderr F stderr {i}\n'
+
+@pytest.mark.parametrize('log_format,wrap', [('docker', to_docker), ('cri', to_cri)])
+@pytest.mark.parametrize('piece_chars', [40, 16 * 1024])
+def test_container_logs_match_plain(log_file, expected, tmp_path, log_format, wrap, piece_chars):
+    with open(log_file, 'rb') as f:
+        lines = f.read().decode('utf-8', errors='ignore').splitlines(keepends=True)
+    path = str(tmp_path / f'{log_format}.log')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(wrap(lines, piece_chars))
+
+    assert module.detect_log_format(path) == log_format
+    assert snapshot(make_parser().extract_files([path])) == expected
+    assert snapshot(make_parser(log_format=log_format).extract_files([path], jobs=2)) == expected
+
+class RejectedRowError(Exception):
+    """模拟 PostgREST 返回的错误，code 为 Postgres 错误码或HTTP状态码"""
+
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.code = code
+
+class FakeQuery:
+    def __init__(self, client: 'FakeSupabaseClient'):
+        self.client = client
+        self.rows = None
+        self.emails = None
+        self.on_conflict = None
+
+    def select(self, columns: str):
+        return self
+
+    def in_(self, column: str, values):
+        self.emails = list(values)
+        return self
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def upsert(self, rows, on_conflict: str, ignore_duplicates: bool = False):
+        assert ignore_duplicates
+        self.rows = rows
+        self.on_conflict = on_conflict
+        return self
+
+    def execute(self):
+        client = self.client
+        if self.emails is not None:
+            with client.lock:
+                client.checked.extend(self.emails)
+                client.active_checks += 1
+                client.max_active_checks = max(client.max_active_checks, client.active_checks)
+            try:
+                if client.slow_emails.intersection(self.emails):
+                    time.sleep(0.1)
+                if client.error is not None:
+                    raise client.error
+                if client.failing_checks.intersection(self.emails):
+                    raise RejectedRowError('service unavailable', '503')
+                return type('Response', (), {'data': [{'email': email} for email in self.emails if email in client.emails]})()
+            finally:
+                with client.lock:
+                    client.active_checks -= 1
+
+        client.requests.append([row['email'] for row in self.rows])
+        if client.error is not None:
+            raise client.error
+        if client.transient_errors:
+            client.transient_errors -= 1
+            raise RejectedRowError('service unavailable', '503')
+        bad = [row['email'] for row in self.rows if row['email'] in client.bad_emails]
+        if bad:
+            raise RejectedRowError(f'new row violates check constraint: {bad[0]}', '23514')
+        if self.on_conflict is not None:
+            if not client.migrated:
+                raise RejectedRowError(f'column "{self.on_conflict}" does not exist', '42703')
+            if self.on_conflict != 'email_normalized':
+                # 只有迁移 0006 的 email_normalized 列带唯一索引
+                raise RejectedRowError('there is no unique or exclusion constraint matching the ON CONFLICT specification',
+                                       '42P10')
+            # ON CONFLICT (email_normalized) DO NOTHING：只返回实际插入的行
+            existing = {email.lower() for email in client.emails}
+            rows = []
+            for row in self.rows:
+                if row['email'].lower() not in existing:
+                    existing.add(row['email'].lower())
+                    rows.append(row)
+            client.emails.update(row['email'] for row in rows)
+            client.inserted.extend(row['email'] for row in rows)
+            return type('Response', (), {'data': rows})()
+        for row in self.rows:
+            assert row['email'] not in client.emails, f"重复插入 {row['email']}"
+            client.emails.add(row['email'])
+        client.inserted.extend(row['email'] for row in self.rows)
+        if client.interrupt_email in client.inserted:
+            # 行已写入，但客户端没有收到响应就被中断
+            raise KeyboardInterrupt
+        return type('Response', (), {'data': self.rows})()
+
+class FakeSupabaseClient:
+    """内存中的 waitlist 表：bad_emails 中的行被数据库拒绝，前 transient_errors 次插入返回503，
+    包含 interrupt_email 的一批写入后中断；提供 error 时每次请求都抛出这个错误；
+    migrated 为 False 时表示没有应用迁移 0006，upsert 的冲突列不存在；
+    包含 slow_emails 的检查请求延迟返回，包含 failing_checks 的检查请求总是返回503"""
+
+    def __init__(self, emails=(), bad_emails=(), transient_errors: int = 0, interrupt_email=None, error=None,
+                 migrated=True, slow_emails=(), failing_checks=()):
+        self.emails = set(emails)
+        self.error = error
+        self.migrated = migrated
+        self.slow_emails = set(slow_emails)
+        self.failing_checks = set(failing_checks)
+        # 检查请求在线程池中并发执行
+        self.lock = threading.Lock()
+        self.active_checks = 0
+        self.max_active_checks = 0
+        self.bad_emails = set(bad_emails)
+        self.transient_errors = transient_errors
+        self.interrupt_email = interrupt_email
+        self.requests = []
+        self.inserted = []
+        self.checked = []
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self)
+
+def make_extractor(client: FakeSupabaseClient, monkeypatch, **kwargs) -> WaitlistExtractor:
+    monkeypatch.setenv('NEXT_PUBLIC_SUPABASE_URL', 'http://localhost:54321')
+    monkeypatch.setenv('SUPABASE_SERVICE_ROLE_KEY', 'test-service-role-key')
+    monkeypatch.setattr(WaitlistExtractor, 'RETRY_BASE_DELAY', 0)
+    extractor = WaitlistExtractor(quiet=True, **kwargs)
+    extractor._supabase = client
+    return extractor
+
+def make_entries(count: int):
+    return [WaitlistEntry(f'user{i}@example.com', f'User {i}', 'hero', created_at=f'2025-07-21T10:{i % 60:02d}:00+00:00')
+            for i in range(count)]
+
+def test_import_consumes_generator_in_batches(monkeypatch):
+    """检查和导入按批读取生成器，不会先把全部条目读入内存"""
+    entries = make_entries(100)
+    client = FakeSupabaseClient(emails={entries[3].email, entries[50].email})
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=10)
+    monkeypatch.setattr(WaitlistExtractor, 'CHECK_BATCH_SIZE', 20)
+    produced = []
+    # 每次插入时生成器已产生、还没有插入的条目数
+    produced_at_insert = []
+    insert_batch = extractor._insert_batch
+
+    def tracking_insert(batch, failed, upsert=False):
+        produced_at_insert.append(len(produced) - len(client.inserted))
+        return insert_batch(batch, failed, upsert)
+
+    def generate():
+        for entry in entries:
+            produced.append(entry)
+            yield entry
+
+    monkeypatch.setattr(extractor, '_insert_batch', tracking_insert)
+    result = extractor.import_to_supabase(extractor.iter_new_entries(generate()))
+
+    assert result == {'success': 98, 'skipped': 0, 'errors': 0, 'total': 98, 'failed': []}
+    assert client.inserted == [entry.email for i, entry in enumerate(entries) if i not in (3, 50)]
+    # 最多多读一批检查的条目和一批插入的条目
+    assert produced_at_insert[0] == 20
+    assert max(produced_at_insert) <= 20 + 10
+
+def test_run_extract_streams_disk_dedup_into_output_and_import(log_file, expected, tmp_path, monkeypatch):
+    """--disk-dedup 时去重后的条目从索引中流式写入输出文件、分批检查和导入"""
+    client = FakeSupabaseClient()
+    make_extractor(client, monkeypatch)
+    monkeypatch.setattr(WaitlistExtractor, 'supabase', property(lambda self: client))
+    monkeypatch.setattr(WaitlistExtractor, 'CHECK_BATCH_SIZE', 20)
+    read = []
+    # 每次插入时已从去重索引中读出的条目数
+    read_at_insert = []
+    index_iter = module.DiskDeduplicator.__iter__
+    insert_batch = WaitlistExtractor._insert_batch
+
+    def tracking_iter(self):
+        for entry in index_iter(self):
+            read.append(entry.email)
+            yield entry
+
+    def tracking_insert(self, batch, failed, upsert=False):
+        read_at_insert.append(len(read))
+        return insert_batch(self, batch, failed, upsert)
+
+    monkeypatch.setattr(module.DiskDeduplicator, '__iter__', tracking_iter)
+    monkeypatch.setattr(WaitlistExtractor, '_insert_batch', tracking_insert)
+    output = str(tmp_path / 'entries.jsonl')
+    monkeypatch.setattr('sys.argv', ['extract_waitlist_from_logs.py', log_file, '--disk-dedup', '--quiet',
+                                     '--insert-batch-size', '10', '--temp-dir', str(tmp_path), '--output', output])
+    module.main()
+
+    unique_emails = list({row['email'].lower(): row['email'] for row in expected}.values())
+    with open(output, encoding='utf-8') as f:
+        assert len(f.readlines()) == len(unique_emails)
+    assert sorted(client.inserted) == sorted(unique_emails)
+    # 输出文件读完一遍索引后，导入时再从头读：第一批插入时只读出了一批检查的条目
+    assert read_at_insert[0] == len(unique_emails) + 20
+    # 去重索引在运行结束后删除
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('waitlist-dedup-')]
+
+def test_concurrent_existence_check_keeps_entry_order(monkeypatch):
+    """分批并发查询时先发出的一批最后返回，新条目仍按原顺序返回，每个邮箱只查询一次"""
+    entries = make_entries(100)
+    # 同一邮箱的多个条目都被跳过或都被保留
+    entries += [WaitlistEntry(entries[i].email, 'Again', 'hero') for i in (7, 8)]
+    existing = {entries[i].email for i in range(0, 100, 7)}
+    client = FakeSupabaseClient(emails=existing, slow_emails={entries[0].email})
+    extractor = make_extractor(client, monkeypatch, check_concurrency=4)
+    monkeypatch.setattr(WaitlistExtractor, 'EXISTENCE_CHECK_MAX_EMAILS', 10)
+
+    new_entries = extractor.check_existing_emails(entries)
+
+    assert new_entries == [entry for entry in entries if entry.email not in existing]
+    assert sorted(client.checked) == sorted(entry.email for entry in entries[:100])
+    assert client.max_active_checks > 1
+
+def test_failed_existence_check_chunk_aborts_before_import(monkeypatch):
+    """某一批查询的重试次数用完时抛出异常，不把这一批的邮箱当作新条目导入"""
+    entries = make_entries(50)
+    client = FakeSupabaseClient(failing_checks={entries[25].email})
+    extractor = make_extractor(client, monkeypatch, check_concurrency=4, check_retries=2)
+    monkeypatch.setattr(WaitlistExtractor, 'EXISTENCE_CHECK_MAX_EMAILS', 10)
+
+    with pytest.raises(RuntimeError, match='已重试 2 次'):
+        extractor.import_to_supabase(extractor.iter_new_entries(entries))
+    assert not client.requests
+    # 失败的一批（第3批）共请求3次，其他批各请求一次
+    assert client.checked.count(entries[25].email) == 3
+    assert client.checked.count(entries[0].email) == 1
+
+def test_email_cache_bloom_false_positives_fall_back_to_sqlite(tmp_path, monkeypatch):
+    """布隆过滤器误判为已缓存的邮箱由 SQLite 确认不在缓存中，仍会查询服务器；重新打开缓存后结果相同"""
+    # 容量很小、误判率很高的过滤器，少量邮箱就会产生误判
+    monkeypatch.setattr(module.KnownEmailsCache, 'BLOOM_CAPACITY', 64)
+    monkeypatch.setattr(module.KnownEmailsCache, 'BLOOM_ERROR_RATE', 0.5)
+    path = str(tmp_path / 'emails.sqlite')
+    cached = [f'cached{i}@example.com' for i in range(60)]
+    entries = make_entries(200)
+    cache = module.KnownEmailsCache(path, 'http://localhost:54321')
+    cache.add(cached)
+    false_positives = [entry.email for entry in entries if entry.email in cache.bloom]
+    assert false_positives
+
+    assert cache.known(cached + [entry.email for entry in entries]) == set(cached)
+    cache.close()
+
+    client = FakeSupabaseClient(emails={false_positives[0]})
+    extractor = make_extractor(client, monkeypatch, email_cache=path)
+    assert extractor.email_cache.known(cached + false_positives) == set(cached)
+    new_entries = extractor.check_existing_emails(entries + [WaitlistEntry(cached[0], 'Cached', 'hero')])
+
+    assert new_entries == [entry for entry in entries if entry.email != false_positives[0]]
+    # 缓存命中的邮箱不查询服务器，误判的邮箱都查询了服务器
+    assert sorted(client.checked) == sorted(entry.email for entry in entries)
+    assert extractor.email_cache.known([false_positives[0]]) == {false_positives[0]}
+
+@pytest.mark.parametrize('bad', [set(), {0}, {63}, {5, 6, 7}, {1, 20, 40, 41, 62}, set(range(64))])
+def test_bisection_reports_exactly_bad_rows(monkeypatch, bad):
+    entries = make_entries(64)
+    bad_emails = {entries[i].email for i in bad}
+    client = FakeSupabaseClient(bad_emails=bad_emails)
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=32)
+
+    result = extractor.import_to_supabase(entries)
+
+    assert {item['email'] for item in result['failed']} == bad_emails
+    assert all('check constraint' in item['error'] for item in result['failed'])
+    assert set(client.inserted) == {entry.email for entry in entries} - bad_emails
+    assert (result['success'], result['errors'], result['skipped']) == (len(entries) - len(bad), len(bad), 0)
+
+def test_transient_errors_are_retried_without_bisecting(monkeypatch):
+    entries = make_entries(10)
+    client = FakeSupabaseClient(transient_errors=2)
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=10, check_retries=3)
+
+    result = extractor.import_to_supabase(entries)
+
+    assert result['success'] == 10 and not result['failed']
+    # 每次重试都是完整的一批，没有被拆分
+    assert [len(emails) for emails in client.requests] == [10, 10, 10]
+
+    client = FakeSupabaseClient(transient_errors=5)
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=10, check_retries=2)
+    result = extractor.import_to_supabase(entries)
+    # 重试次数用完后整批记为失败
+    assert result['errors'] == 10 and not client.inserted
+    assert [len(emails) for emails in client.requests] == [10, 10, 10]
+
+@pytest.mark.parametrize('code', ['42P10', '42P01', '42501', 'PGRST204', 'PGRST301', '401', '403'])
+def test_fatal_errors_abort_import_without_retry_or_bisecting(monkeypatch, code):
+    """认证、权限和表结构错误每一批都会同样失败：第一次请求后就中止导入，不重试也不拆分"""
+    entries = make_entries(20)
+    client = FakeSupabaseClient(error=RejectedRowError('request rejected', code))
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=10, check_retries=3)
+
+    with pytest.raises(module.ImportAbortedError, match=code):
+        extractor.import_to_supabase(entries)
+    assert [len(emails) for emails in client.requests] == [10]
+
+    with pytest.raises(module.ImportAbortedError, match=code):
+        extractor.check_existing_emails(entries)
+    assert len(client.checked) == 20
+
+def test_other_errors_fail_batch_without_bisecting(monkeypatch):
+    """既不是临时错误也不是行被拒绝的错误：这一批记为失败，不拆分，继续导入下一批"""
+    entries = make_entries(20)
+    client = FakeSupabaseClient(error=RejectedRowError('internal error', 'XX000'))
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=10)
+
+    result = extractor.import_to_supabase(entries)
+
+    assert result['errors'] == 20
+    assert [len(emails) for emails in client.requests] == [10, 10]
+
+def test_upsert_skips_existing_emails_case_insensitively(monkeypatch):
+    """upsert 模式由数据库按小写邮箱跳过已存在的行（包括同一批中大小写不同的邮箱），被拒绝的行仍二分拆分"""
+    entries = make_entries(20)
+    entries.append(WaitlistEntry(entries[4].email.upper(), 'Again', 'hero'))
+    client = FakeSupabaseClient(emails={entries[2].email.upper(), entries[11].email}, bad_emails={entries[15].email})
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=8)
+
+    result = extractor.import_to_supabase(entries, upsert=True)
+
+    assert client.inserted == [entry.email for i, entry in enumerate(entries[:20]) if i not in (2, 11, 15)]
+    assert [item['email'] for item in result['failed']] == [entries[15].email]
+    assert (result['success'], result['skipped'], result['errors'], result['total']) == (17, 3, 1, 21)
+
+def test_main_upsert_imports_without_checking_existing_emails(log_file, expected, tmp_path, monkeypatch):
+    """--upsert 不查询已存在的邮箱，已存在的邮箱由数据库跳过并计入已存在跳过"""
+    unique_emails = list({row['email'].lower(): row['email'] for row in expected}.values())
+    existing = {email.upper() for email in unique_emails[:5]}
+    client = FakeSupabaseClient(emails=existing)
+    make_extractor(client, monkeypatch)
+    monkeypatch.setattr(WaitlistExtractor, 'supabase', property(lambda self: client))
+    report = str(tmp_path / 'report.json')
+    monkeypatch.setattr('sys.argv', ['extract_waitlist_from_logs.py', log_file, '--upsert', '--quiet', '--report', report])
+    module.main()
+
+    assert not client.checked
+    assert sorted(client.inserted) == sorted(unique_emails[5:])
+    with open(report, encoding='utf-8') as f:
+        result = json.load(f)['result']
+    assert (result['success'], result['skipped'], result['errors']) == (len(unique_emails) - 5, 5, 0)
+
+@pytest.mark.parametrize('error', [
+    None,
+    RejectedRowError('there is no unique or exclusion constraint matching the ON CONFLICT specification', '42P10'),
+])
+def test_upsert_before_migration_aborts_with_migration_hint(monkeypatch, error):
+    """没有应用迁移 0006 时 --upsert 的冲突列不存在（42703）或没有唯一索引（42P10）：中止导入并提示应用迁移"""
+    client = FakeSupabaseClient(migrated=False, error=error)
+    extractor = make_extractor(client, monkeypatch, insert_batch_size=10)
+
+    with pytest.raises(module.ImportAbortedError, match='migrations/0006_waitlist_email_unique.sql'):
+        extractor.import_to_supabase(make_entries(20), upsert=True)
+    assert len(client.requests) == 1 and not client.inserted
+
+def run_pipeline(extractor, entries, handler, monkeypatch, **kwargs):
+    """用 httpx 的 MockTransport 代替 Supabase REST API 运行异步导入流水线"""
+    import httpx
+    from waitlist_pipeline import AsyncImportPipeline
+    transport = httpx.MockTransport(handler)
+    client_class = httpx.AsyncClient
+    monkeypatch.setattr(httpx, 'AsyncClient', lambda **options: client_class(transport=transport, **options))
+    return AsyncImportPipeline(extractor, **kwargs).run(entries)
+
+@pytest.mark.parametrize('status,body', [
+    (400, {'code': '42P10', 'message': 'there is no unique or exclusion constraint matching the ON CONFLICT specification'}),
+    (404, {'code': '42P01', 'message': 'relation "public.waitlist" does not exist'}),
+    (401, {'message': 'Invalid API key'}),
+])
+def test_pipeline_fatal_errors_abort_import(monkeypatch, status, body):
+    httpx = pytest.importorskip('httpx')
+    entries = make_entries(20)
+    extractor = make_extractor(FakeSupabaseClient(), monkeypatch)
+    posts = []
+
+    def handler(request):
+        if request.method == 'GET':
+            return httpx.Response(200, json=[])
+        posts.append(json.loads(request.content))
+        return httpx.Response(status, json=body)
+
+    with pytest.raises(module.ImportAbortedError, match=body.get('code', str(status))):
+        run_pipeline(extractor, entries, handler, monkeypatch, writers=1, batch_size=10)
+    # 第一批失败后不再拆分或插入其他批次
+    assert [len(rows) for rows in posts] == [10]
+
+def test_pipeline_upsert_before_migration_aborts_with_migration_hint(monkeypatch):
+    httpx = pytest.importorskip('httpx')
+    extractor = make_extractor(FakeSupabaseClient(), monkeypatch)
+    conflicts = []
+
+    def handler(request):
+        conflicts.append(request.url.params.get('on_conflict'))
+        return httpx.Response(400, json={'code': '42P10', 'message': 'there is no unique or exclusion constraint '
+                                                                     'matching the ON CONFLICT specification'})
+
+    with pytest.raises(module.ImportAbortedError, match='migrations/0006_waitlist_email_unique.sql'):
+        run_pipeline(extractor, make_entries(20), handler, monkeypatch, writers=1, batch_size=10, upsert=True)
+    # upsert 模式不查询已存在的邮箱，第一次插入就中止
+    assert conflicts == ['email_normalized']
+
+def test_pipeline_bisects_only_rejected_rows(monkeypatch):
+    httpx = pytest.importorskip('httpx')
+    entries = make_entries(16)
+    bad = entries[5].email
+    extractor = make_extractor(FakeSupabaseClient(), monkeypatch)
+
+    def handler(request):
+        if request.method == 'GET':
+            return httpx.Response(200, json=[])
+        rows = json.loads(request.content)
+        if any(row['email'] == bad for row in rows):
+            return httpx.Response(400, json={'code': '23514', 'message': 'new row violates check constraint'})
+        return httpx.Response(201, json=[{'email': row['email']} for row in rows])
+
+    result = run_pipeline(extractor, entries, handler, monkeypatch, writers=2, batch_size=8)
+
+    assert (result['success'], result['errors']) == (15, 1)
+    assert result['failed'][0]['email'] == bad
+
+@pytest.mark.parametrize('interrupted', [1, 2, 4])
+def test_resume_completes_exactly_remaining_batches(tmp_path, monkeypatch, interrupted):
+    """5批条目，第0批中有一条被拒绝；第 interrupted 批写入后、收到响应前中断，继续导入只完成剩下的部分"""
+    entries = make_entries(15)
+    batches = [entries[start:start + 3] for start in range(0, 15, 3)]
+    journal_file = str(tmp_path / 'journal.sqlite3')
+    client = FakeSupabaseClient(bad_emails={entries[1].email}, interrupt_email=batches[interrupted][0].email)
+
+    with ImportJournal(journal_file) as journal:
+        journal.record(entries, batch_size=3)
+        with pytest.raises(KeyboardInterrupt):
+            make_extractor(client, monkeypatch).import_to_supabase(entries, journal=journal)
+
+    written = {entry.email for batch in batches[:interrupted + 1] for entry in batch} - {entries[1].email}
+    assert client.emails == written
+
+    client.bad_emails.clear()
+    client.interrupt_email = None
+    client.inserted.clear()
+    with ImportJournal(journal_file) as journal:
+        assert journal.progress() == {journal.COMMITTED: interrupted - 1, journal.FAILED: 1, journal.PENDING: 5 - interrupted}
+        result = make_extractor(client, monkeypatch).resume_import(journal)
+        assert journal.unfinished() == 0
+
+    # 只插入被拒绝的条目和中断之后的批次，每个邮箱恰好写入一次（FakeQuery 在重复插入时断言失败）
+    remaining = [entries[1].email] + [entry.email for batch in batches[interrupted + 1:] for entry in batch]
+    assert client.inserted == remaining
+    assert client.emails == {entry.email for entry in entries}
+    assert (result['success'], result['skipped'], result['errors']) == (len(remaining), 3, 0)
+    # 已提交的批次不再查询已存在的邮箱，只查询可能已部分写入的批次（失败的批次和中断时正在插入的批次）
+    assert set(client.checked) == {entries[1].email} | {entry.email for entry in batches[interrupted]}
+
+def test_config_cache_does_not_store_service_role_key(tmp_path, monkeypatch):
+    """配置缓存只保存 URL 和密钥来源，命中缓存时从来源重新读取密钥；旧版本包含密钥的缓存文件被删除"""
+    cache_file = str(tmp_path / 'cache' / 'supabase-config.json')
+    monkeypatch.setattr(module, 'CONFIG_CACHE_FILE', cache_file)
+    monkeypatch.setattr(module, 'CONFIG_CACHE_TTL', 3600)
+    monkeypatch.setattr(module, 'CONFIG_FILES', ['.env.local'])
+    monkeypatch.setenv('NEXT_PUBLIC_SUPABASE_URL', 'http://localhost:54321')
+    monkeypatch.delenv('SUPABASE_SERVICE_ROLE_KEY', raising=False)
+    monkeypatch.chdir(tmp_path)
+    commands = []
+
+    def no_cli(command, **kwargs):
+        commands.append(command)
+        raise FileNotFoundError(command[0])
+
+    monkeypatch.setattr(module.subprocess, 'run', no_cli)
+    env_file = tmp_path / '.env.local'
+    env_file.write_text('SUPABASE_SERVICE_ROLE_KEY=first-secret\n', encoding='utf-8')
+    os.utime(env_file, (1000000000, 1000000000))
+    assert module.get_supabase_config()['service_role_key'] == 'first-secret'
+    with open(cache_file, encoding='utf-8') as f:
+        cached = f.read()
+    assert 'first-secret' not in cached and '.env.local' in cached
+
+    # 修改时间不变时缓存仍然有效：不再调用 supabase CLI，密钥从记录的配置文件重新读取
+    commands.clear()
+    env_file.write_text('SUPABASE_SERVICE_ROLE_KEY=second-secret\n', encoding='utf-8')
+    os.utime(env_file, (1000000000, 1000000000))
+    assert module.get_supabase_config()['service_role_key'] == 'second-secret'
+    assert not commands
+
+    with open(cache_file, 'w', encoding='utf-8') as f:
+        json.dump({'key': 'old', 'saved_at': 0, 'config': {'service_role_key': 'first-secret'}}, f)
+    assert module._load_cached_config('old') is None
+    assert not os.path.exists(cache_file)
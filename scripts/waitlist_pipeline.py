@@ -0,0 +1,253 @@
+"""
+waitlist 异步导入流水线（--pipeline）
+
+单独成模块，只在使用 --pipeline 时导入，普通运行不需要加载 asyncio 和 httpx。
+"""
+import asyncio
+import random
+import time
+from typing import List, Dict, Iterable
+
+try:
+    import httpx  # 可选依赖：异步导入流水线
+except ImportError:
+    httpx = None
+
+class AsyncImportPipeline:
+    """基于 asyncio 的导入流水线，让日志解析与网络请求重叠执行
+    
+    生产者在线程中解析日志并去重（与默认流程相同，同一邮箱不区分大小写只保留最新的条目），
+    新出现的邮箱按批放入有界队列（队列满时生产者阻塞，形成背压），多个异步写入任务共享一个 httpx 连接池，
+    边解析边查询其中已存在的邮箱。解析结束后去重结果才确定，这时再由写入任务并发插入数据库中不存在的条目。
+    请求遇到 429/5xx 或连接错误时按指数退避重试（优先使用 Retry-After），
+    插入的行被数据库拒绝时二分拆分，隔离出错的条目；认证、权限和表结构错误抛出 ImportAbortedError 中止导入
+    （错误分类与 WaitlistExtractor 相同，见 classify_error）。需要安装 httpx。
+    """
+    
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    
+    def __init__(self, extractor: 'WaitlistExtractor', writers=4, batch_size=500, retries=3,
+                 upsert=False, check_existing=True, queue_size=None):
+        if httpx is None:
+            raise RuntimeError("异步导入流水线需要安装 httpx: pip install httpx")
+        
+        self.extractor = extractor
+        self.writers = writers
+        self.batch_size = batch_size
+        self.retries = retries
+        self.upsert = upsert
+        # upsert 模式由数据库跳过已存在的邮箱，不需要事先查询
+        self.check_existing = check_existing and not upsert
+        self.queue_size = queue_size or writers * 2
+        self.endpoint = f"{extractor.supabase_url.rstrip('/')}/rest/v1/waitlist"
+    
+    def run(self, entries: Iterable['WaitlistEntry']) -> Dict:
+        """消费条目并导入，返回与 import_to_supabase 相同结构的结果（另含 duplicates）"""
+        return asyncio.run(self._run(entries))
+    
+    async def _run(self, entries: Iterable['WaitlistEntry']) -> Dict:
+        result = {'success': 0, 'skipped': 0, 'errors': 0, 'total': 0, 'duplicates': 0, 'failed': []}
+        loop = asyncio.get_running_loop()
+        # 已存在的邮箱；查询失败的邮箱 -> 错误原因
+        existing = set()
+        check_errors = {}
+        
+        key = self.extractor.supabase_key
+        headers = {'apikey': key, 'Authorization': f"Bearer {key}"}
+        limits = httpx.Limits(max_connections=self.writers * 2, max_keepalive_connections=self.writers * 2)
+        
+        self.extractor._log_info(f"\n开始流水线导入（{self.writers} 个写入任务，每批 {self.batch_size} 个条目）...")
+        async with httpx.AsyncClient(headers=headers, limits=limits, timeout=30) as client:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            checkers = [asyncio.create_task(self._checker(client, queue, existing, check_errors))
+                        for _ in range(self.writers)]
+            try:
+                unique = await asyncio.to_thread(self._produce, entries, queue, loop, result)
+            finally:
+                # 解析出错时也要让写入任务处理完队列中的批次后退出
+                for _ in checkers:
+                    await queue.put(None)
+                await asyncio.gather(*checkers)
+            
+            result['total'] = len(unique)
+            new_entries = []
+            for entry in unique:
+                if entry.email in check_errors:
+                    # 检查失败时不能把条目当作新条目导入
+                    result['failed'].append({'email': entry.email, 'error': check_errors[entry.email]})
+                elif entry.email not in existing:
+                    new_entries.append(entry)
+            
+            queue = asyncio.Queue()
+            for start in range(0, len(new_entries), self.batch_size):
+                queue.put_nowait(new_entries[start:start + self.batch_size])
+            for _ in range(self.writers):
+                queue.put_nowait(None)
+            await asyncio.gather(*(self._writer(client, queue, result) for _ in range(self.writers)))
+        
+        result['errors'] = len(result['failed'])
+        result['skipped'] = result['total'] - result['success'] - result['errors']
+        if self.extractor.email_cache is not None:
+            self.extractor.email_cache.save()
+        if result['success']:
+            self.extractor._log_info(f"✓ 成功导入 {result['success']} 个条目")
+        if result['skipped']:
+            self.extractor._log_info(f"跳过 {result['skipped']} 个已存在的邮箱")
+        for item in result['failed']:
+            self.extractor._log_info(f"✗ {item['email']}: {item['error']}")
+        return result
+    
+    def _produce(self, entries: Iterable['WaitlistEntry'], queue: 'asyncio.Queue', loop, result: Dict) -> List['WaitlistEntry']:
+        """在线程中解析日志并去重，返回去重后的条目；需要检查时把新出现的邮箱按批放入队列，队列满时阻塞
+        
+        去重规则与 deduplicate_entries 相同：同一邮箱保留最新的条目（时间相同时保留先出现的），
+        重复条目计入后出现的条目所在文件的统计。保留的条目可能与先出现的条目大小写不同，
+        所以每个不同的邮箱字符串都会被检查。
+        """
+        unique = {}
+        checked = set()
+        batch = []
+        for entry in entries:
+            existing = unique.get(entry.email_key)
+            if existing is None or entry.timestamp > existing.timestamp:
+                unique[entry.email_key] = entry
+            if existing is not None:
+                result['duplicates'] += 1
+                self.extractor.stats.add_duplicate(entry.origin)
+            if not self.check_existing or entry.email in checked:
+                continue
+            checked.add(entry.email)
+            batch.append(entry.email)
+            if len(batch) >= self.batch_size:
+                asyncio.run_coroutine_threadsafe(queue.put(batch), loop).result()
+                batch = []
+        if batch:
+            asyncio.run_coroutine_threadsafe(queue.put(batch), loop).result()
+        return list(unique.values())
+    
+    async def _checker(self, client: 'httpx.AsyncClient', queue: 'asyncio.Queue', existing: set, check_errors: Dict):
+        """从队列取出一批邮箱，查询其中已存在的邮箱，直到收到 None"""
+        while True:
+            emails = await queue.get()
+            if emails is None:
+                return
+            try:
+                existing.update(await self._existing_emails(client, emails))
+            except (RuntimeError, ValueError) as e:
+                # 重试次数用完，这些邮箱的条目都不导入
+                check_errors.update((email, str(e)) for email in emails)
+                continue
+            self.extractor._log_verbose(f"已检查 {len(emails)} 个邮箱，累计 {len(existing)} 个已存在")
+    
+    async def _writer(self, client: 'httpx.AsyncClient', queue: 'asyncio.Queue', result: Dict):
+        """从队列取出批次并插入，直到收到 None"""
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            inserted = await self._insert(client, batch, result['failed'])
+            result['success'] += inserted
+            self.extractor._log_verbose(f"已插入 {result['success']} 个条目")
+    
+    async def _existing_emails(self, client: 'httpx.AsyncClient', emails: List[str]) -> set:
+        """查询一批邮箱中已存在的邮箱，本地缓存中没有的邮箱按URL长度分批并发查询"""
+        async def query(chunk):
+            values = ','.join('"' + email.replace('\\', '\\\\').replace('"', '\\"') + '"' for email in chunk)
+            response = await self._request(client, 'GET', params={'select': 'email', 'email': f"in.({values})"})
+            if not response.is_success:
+                error = f"HTTP {response.status_code}: {response.text}"
+                code = self._error_code(response)
+                if self.extractor.classify_error(code) == 'fatal':
+                    raise self.extractor.abort_error(code, error)
+                raise RuntimeError(f"检查已存在邮箱失败: {error}")
+            return {row['email'] for row in response.json()}
+        
+        cache = self.extractor.email_cache
+        known = cache.known(emails) if cache is not None else set()
+        self.extractor.metrics.count('email_cache_hits', len(known))
+        unknown = [email for email in emails if email not in known]
+        found = set().union(*await asyncio.gather(*(query(chunk) for chunk in self.extractor._chunk_emails(unknown))))
+        if cache is not None:
+            cache.add(found)
+        return known | found
+    
+    async def _insert(self, client: 'httpx.AsyncClient', entries: List['WaitlistEntry'], failed: List[Dict]) -> int:
+        """插入一批条目，返回成功插入的条目数；行被拒绝时二分拆分重试，把无法插入的条目及原因加入 failed
+        
+        只在认证、权限和表结构错误时抛出 ImportAbortedError；重试次数用完的请求和其他错误中的条目都加入 failed。
+        """
+        params = {'select': 'email'}
+        prefer = 'return=representation'
+        if self.upsert:
+            # 冲突的行不会被返回，返回的只有实际插入的行
+            params['on_conflict'] = self.extractor.UPSERT_CONFLICT_COLUMN
+            prefer += ',resolution=ignore-duplicates'
+        
+        try:
+            response = await self._request(client, 'POST', params=params, json=[entry.to_dict() for entry in entries],
+                                           headers={'Prefer': prefer})
+        except RuntimeError as e:
+            # 重试次数用完，只有这一次请求中的条目导入失败，之前拆分出的请求已插入的条目不受影响
+            failed.extend({'email': entry.email, 'error': str(e)} for entry in entries)
+            return 0
+        if response.is_success:
+            rows = response.json()
+            if self.extractor.email_cache is not None:
+                self.extractor.email_cache.add(row['email'] for row in rows)
+            return len(rows)
+        
+        error = f"HTTP {response.status_code}: {response.text}"
+        code = self._error_code(response)
+        kind = self.extractor.classify_error(code)
+        if kind == 'fatal':
+            raise self.extractor.abort_error(code, error)
+        if kind != 'row' or len(entries) == 1:
+            failed.append({'email': entries[0].email, 'error': error})
+            return 0
+        
+        self.extractor._log_verbose(f"批量插入 {len(entries)} 个条目失败，拆分后重试: {error}")
+        self.extractor.metrics.count('insert_splits')
+        middle = len(entries) // 2
+        return await self._insert(client, entries[:middle], failed) + await self._insert(client, entries[middle:], failed)
+    
+    @staticmethod
+    def _error_code(response: 'httpx.Response') -> str:
+        """错误响应的错误码：PostgREST 返回的 code（Postgres 错误码或 PGRSTxxx），没有时为HTTP状态码
+        
+        401/403 始终按状态码处理（网关返回的认证错误不带 code，PostgREST 的 JWT 错误带 PGRST3xx）。
+        """
+        if response.status_code in (401, 403):
+            return str(response.status_code)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        code = body.get('code') if isinstance(body, dict) else None
+        return str(code) if code else str(response.status_code)
+    
+    async def _request(self, client: 'httpx.AsyncClient', method: str, **kwargs) -> 'httpx.Response':
+        """发送请求，429/5xx 和连接错误按指数退避重试；其他响应直接返回，重试次数用完后抛出 RuntimeError"""
+        metrics = self.extractor.metrics
+        operation = 'check' if method == 'GET' else 'insert'
+        for attempt in range(self.retries + 1):
+            delay = self.extractor.RETRY_BASE_DELAY * 2 ** attempt * (0.5 + random.random())
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, self.endpoint, **kwargs)
+            except httpx.TransportError as e:
+                metrics.observe(operation, time.perf_counter() - start, error=True)
+                error = f"{type(e).__name__}: {e}"
+            else:
+                metrics.observe(operation, time.perf_counter() - start, error=not response.is_success)
+                if response.status_code not in self.RETRY_STATUS:
+                    return response
+                error = f"HTTP {response.status_code}: {response.text}"
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = float(retry_after)
+            
+            if attempt == self.retries:
+                raise RuntimeError(f"请求失败（已重试 {self.retries} 次）: {error}")
+            metrics.count(f'retries.{operation}')
+            self.extractor._log_verbose(f"请求出错，{delay:.1f} 秒后重试: {error}")
+            await asyncio.sleep(delay)
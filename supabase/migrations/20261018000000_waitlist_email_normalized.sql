@@ -0,0 +1,19 @@
+-- Make waitlist emails unique regardless of case
+-- PostgREST on_conflict can only target columns (not index expressions), so the
+-- lower-cased email is stored in a generated column with a unique index on it.
+-- scripts/extract_waitlist_from_logs.py --upsert relies on this column.
+
+-- Existing rows are never deleted here: if emails that differ only by case exist,
+-- the migration fails. Review and run scripts/dedupe-waitlist-emails.sql first.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM waitlist GROUP BY lower(email) HAVING count(*) > 1) THEN
+        RAISE EXCEPTION 'waitlist contains emails that differ only by case'
+            USING HINT = 'Review and run scripts/dedupe-waitlist-emails.sql, then rerun this migration';
+    END IF;
+END $$;
+
+ALTER TABLE waitlist
+    ADD COLUMN IF NOT EXISTS email_normalized TEXT GENERATED ALWAYS AS (lower(email)) STORED;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_waitlist_email_normalized ON waitlist(email_normalized);